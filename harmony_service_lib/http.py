@@ -9,14 +9,14 @@ This module relies on the harmony_service_lib.util.config and its environment va
 set for correct operation. See that module and the project README for details.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 import json
-from time import sleep
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
-import datetime
-import sys
-import os
-import re
+from time import monotonic_ns, sleep
+from typing import Optional
+from urllib.parse import urlparse, urlsplit, parse_qs, urlencode, urlunparse
+import threading
+from requests.adapters import HTTPAdapter
 from harmony_service_lib.earthdata import EarthdataAuth, EarthdataSession
 from harmony_service_lib.exceptions import ServerException, ForbiddenException
 from harmony_service_lib.logging import build_logger
@@ -31,6 +31,15 @@ TIMEOUT = 60
 
 MAX_RETRY_DELAY_SECS = 90
 
+# Number of connections urllib3 keeps alive per host in the shared session's
+# pool, so that successive downloads from the same host reuse an established
+# TCP / TLS connection rather than handshaking again.
+POOL_SIZE = 16
+
+# The most bytes read from the body of a failed response. Enough to diagnose
+# EULA and other errors without downloading a large streamed body.
+ERROR_BODY_LIMIT = 4096
+
 # `request_context` is used to provide information about the request to functions like `download`
 # without adding extra function arguments
 request_context = {}
@@ -68,7 +77,10 @@ def is_http(url: str) -> bool:
         Whether the URL is an http endpoint.
 
     """
-    return url is not None and urlparse(url).scheme in ['http', 'https']
+    # Schemes are case-insensitive, so only lower-case the prefix that can hold one.
+    # requests ignores leading whitespace, and lstrip returns the url itself when
+    # there is none.
+    return url is not None and url.lstrip()[:8].lower().startswith(('http://', 'https://'))
 
 
 def localhost_url(url, local_hostname):
@@ -88,48 +100,76 @@ def localhost_url(url, local_hostname):
     return url.replace('localhost', local_hostname)
 
 
-def _is_eula_error(body: str) -> bool:
+def _eula_error_message(body: bytes) -> Optional[str]:
     """
     Tries to determine if the exception is due to a EULA that the user needs to
-    approve, and if so, returns a response with the url where they can do so.
+    approve, and if so, constructs a user-friendly error indicating the required
+    EULA acceptance and the URL where the user can do so. The body is parsed
+    only once.
 
     Parameters
     ----------
-    body: The body JSON string that may contain the EULA details.
+    body: The response body bytes that may contain the EULA details.
 
     Returns
     -------
-    A boolean indicating if the body contains a EULA error
+    The string with the EULA message, or None if the body is not a EULA error
     """
+    # Most error bodies are not EULA errors (or not JSON at all), so avoid
+    # parsing them when the expected keys do not appear
+    if b'resolution_url' not in body or b'error_description' not in body:
+        return None
     try:
         json_object = json.loads(body)
-        return "error_description" in json_object and "resolution_url" in json_object
-    except Exception:
-        return False
+    except ValueError:
+        # Not JSON (json.JSONDecodeError) or not valid UTF-8 (UnicodeDecodeError)
+        return None
+    if not isinstance(json_object, dict) or \
+            "error_description" not in json_object or "resolution_url" not in json_object:
+        return None
+    return (f"Request could not be completed because you need to agree to the EULA "
+            f"at {json_object['resolution_url']}")
 
 
-def _eula_error_message(body: str) -> str:
-    """
-    Constructs a user-friendly error indicating the required EULA
-    acceptance and the URL where the user can do so.
+# Every session mounts this one adapter, so all threads draw kept-alive
+# connections from the same pool.
+_adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
 
-    Parameters
-    ----------
-    body: The body JSON string that may contain the EULA details.
+# Each thread gets its own EarthdataSession, created on first use and never
+# closed. `_download` sets the session's `auth` per request, and
+# `EarthdataSession.rebuild_auth` reads it again on redirects, so a session
+# shared across threads would send one thread's token on another's request.
+_sessions = threading.local()
 
-    Returns
-    -------
-    The string with the EULA message
-    """
-    json_object = json.loads(body)
-    return (f"Request could not be completed because you need to agree to the EULA "
-            f"at {json_object['resolution_url']}")
+
+def _earthdata_session():
+    """Returns the calling thread's EarthdataSession used to download one or
+    more files, constructing it with the shared pooled adapter on the first call."""
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = EarthdataSession()
+        session.mount('https://', _adapter)
+        session.mount('http://', _adapter)
+        _sessions.session = session
+    return session
 
 
 @lru_cache(maxsize=128)
-def _earthdata_session():
-    """Constructs an EarthdataSession for use to download one or more files."""
-    return EarthdataSession()
+def _earthdata_auth(access_token):
+    """Returns the EarthdataAuth for the given access token, so that it is built
+    once per token rather than once per download."""
+    return EarthdataAuth(access_token)
+
+
+def _limit_error_body(response):
+    """Makes at most the first ERROR_BODY_LIMIT bytes of a failed, streamed
+    response's body its `content`, and releases the connection.
+
+    The body of a streamed response has not been read yet, and reading
+    `response.content` would otherwise download all of it.
+    """
+    response._content = response.raw.read(ERROR_BODY_LIMIT, decode_content=True) or b''
+    response.close()
 
 
 def _add_api_request_uuid(url):
@@ -208,7 +248,9 @@ def _download(
     headers = {}
     if user_agent is not None:
         headers['user-agent'] = user_agent
-    auth = EarthdataAuth(access_token)
+    session = _earthdata_session()
+    session.auth = _earthdata_auth(access_token)
+    stream = kwargs_download_agent.get('stream', False)
     tries = 0
     retry = True
     response = None
@@ -217,8 +259,6 @@ def _download(
         retry = False
         tries += 1
         try:
-            session = _earthdata_session()
-            session.auth = auth
             if data is None and len(url) > config.post_url_length:
                 parsed_url = urlparse(url)
                 data = parsed_url.query
@@ -229,6 +269,8 @@ def _download(
                 if response.ok:
                     return response
                 else:
+                    if stream:
+                        _limit_error_body(response)
                     raise Exception(f'Unable to download due to status code: {response.status_code} \
                         and content {response.content}')
             else:
@@ -244,18 +286,21 @@ def _download(
                 if response.ok:
                     return response
                 else:
+                    if stream:
+                        _limit_error_body(response)
                     raise Exception(f'Unable to download due to status code: {response.status_code} \
                         and content {response.content}')
 
         except Exception:
-            if response is not None and _is_eula_error(response.content):
-                msg = _eula_error_message(response.content)
-                logger.info(f'{msg} due to: {response.content}')
+            body = response.content if response is not None else None
+            msg = _eula_error_message(body) if body is not None else None
+            if msg is not None:
+                logger.info(f'{msg} due to: {body}')
                 return response
 
             if response is not None and response.status_code in (401, 403):
                 msg = f'Forbidden: Unable to download {url}. Will not retry.'
-                logger.info(f'{msg} due to: {response.content}')
+                logger.info(f'{msg} due to: {body}')
                 return response
 
             if tries < total_retries:
@@ -268,6 +313,19 @@ def _download(
                 return response
 
 
+class _CountingWriter(object):
+    """Wraps a file-like object opened for binary write and counts the bytes
+    written through it, so the download size is known without a stat of the
+    destination (which may have no name, e.g. an in-memory buffer)."""
+    def __init__(self, destination_file):
+        self.destination_file = destination_file
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.destination_file.write(data)
+
+
 def _log_download_performance(logger, url, duration_ms, file_size):
     """Logs a message tracking performance information related to a file download.
 
@@ -284,13 +342,11 @@ def _log_download_performance(logger, url, duration_ms, file_size):
     """
     host = 'Unknown'
     url_path = ''
-    try:
-        match = re.search('.*://([^/]+)(.*)', url)
-        if match:
-            host = match.group(1)
-            url_path = match.group(2)
-    except Exception:
-        logger.exception(f'Unable to extract host name from {url}')
+    parts = urlsplit(url)
+    if parts.netloc:
+        host = parts.netloc
+        # Keep the query string in the logged path, as earlier versions did
+        url_path = f'{parts.path}?{parts.query}' if parts.query else parts.path
     extra_fields = {
         'durationMs': duration_ms,
         'host': host,
@@ -354,7 +410,7 @@ def download(config, url: str, access_token: str, data, destination_file,
     logger = build_logger(config)
     # Add the request ID to the download url so it can be used by Cloud Metrics
     url = _add_api_request_uuid(url)
-    start_time = datetime.datetime.now()
+    start_ns = monotonic_ns()
     logger.info(f'timing.download.start {url}')
 
     if (not stream) and buffer_size:
@@ -372,29 +428,65 @@ def download(config, url: str, access_token: str, data, destination_file,
     if response is not None and response.ok:
         if not stream:
             destination_file.write(response.content)
-            file_size = sys.getsizeof(response.content)
+            file_size = len(response.content)
         else:
+            counting_file = _CountingWriter(destination_file)
+            # iter_content keeps reading until the body is exhausted even when a
+            # compressed chunk decodes to nothing, and raises requests exceptions
             for chunk in response.iter_content(chunk_size=buffer_size):
-                destination_file.write(chunk)
-            file_size = os.path.getsize(destination_file.name)
-        time_diff = datetime.datetime.now() - start_time
-        duration_ms = int(round(time_diff.total_seconds() * 1000))
-        duration_logger = build_logger(config)
-        _log_download_performance(duration_logger, url, duration_ms, file_size)
+                counting_file.write(chunk)
+            file_size = counting_file.bytes_written
+        duration_ms = round((monotonic_ns() - start_ns) / 1_000_000)
+        _log_download_performance(logger, url, duration_ms, file_size)
 
         return response
 
-    if _is_eula_error(response.content):
-        msg = _eula_error_message(response.content)
-        logger.info(f'{msg} due to: {response.content}')
+    body = response.content
+    msg = _eula_error_message(body)
+    if msg is not None:
+        logger.info(f'{msg} due to: {body}')
         raise ForbiddenException(msg)
 
     if response.status_code in (401, 403):
         msg = f'Forbidden: Unable to download {url}'
-        logger.info(f'{msg} due to: {response.content}')
+        logger.info(f'{msg} due to: {body}')
         raise ForbiddenException(msg)
 
     msg = f'Unable to download due to status code: {response.status_code} and content \
-        {response.content} and all retries exhausted.'
+        {body} and all retries exhausted.'
     logger.error(msg)
     raise ServerException(msg)
+
+
+def download_all(config, items, user_agent=None, max_workers=8):
+    """Downloads several urls concurrently, each with `download`, using a pool
+    of worker threads that share the pooled EarthdataSession.
+
+    Parameters
+    ----------
+    config : harmony_service_lib.util.Config
+        The configuration for the current runtime environment.
+    items : iterable of (str, str, dict or Tuple[str, str], file-like)
+        The `(url, access_token, data, destination_file)` arguments for each
+        download, as would be passed to `download`.
+    user_agent : str
+        The user agent that is requesting the downloads.
+    max_workers : int
+        The maximum number of downloads to run at the same time. Capped at
+        POOL_SIZE so that every worker's connection is kept alive in the pool.
+
+    Returns
+    -------
+    list of requests.Response with the download results, in the same order
+    as the given items
+
+    Raises
+    ------
+    The first exception raised by `download`, in the order of the given items
+    """
+    with ThreadPoolExecutor(max_workers=min(max_workers, POOL_SIZE)) as executor:
+        futures = [
+            executor.submit(download, config, url, access_token, data, destination_file, user_agent)
+            for url, access_token, data, destination_file in items
+        ]
+        return [future.result() for future in futures]
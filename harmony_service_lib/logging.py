@@ -14,8 +14,9 @@ class HarmonyJsonFormatter(jsonlogger.JsonFormatter):
         super(HarmonyJsonFormatter, self).add_fields(
             log_record, record, message_dict)
         if not log_record.get('timestamp'):
-            now = dt.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-            log_record['timestamp'] = now
+            # Stamp the time the record was created, which the record already holds
+            created = dt.datetime.fromtimestamp(record.created, dt.timezone.utc).replace(tzinfo=None)
+            log_record['timestamp'] = created.isoformat(timespec='microseconds') + 'Z'
         if log_record.get('level'):
             log_record['level'] = log_record['level'].upper()
         else:
@@ -24,6 +25,14 @@ class HarmonyJsonFormatter(jsonlogger.JsonFormatter):
             log_record['application'] = self.app_name
 
 
+def _redacted(msg):
+    """Returns a shallow copy of the Message with its access token redacted. Only
+    the top-level accessToken attribute differs, so the children are shared."""
+    clone = copy.copy(msg)
+    clone.accessToken = '<redacted>'
+    return clone
+
+
 class RedactorFormatter(object):
     """Redacts sensitive information from logs."""
     def __init__(self, original_formatter):
@@ -32,27 +41,15 @@ class RedactorFormatter(object):
     def format(self, record):
         # need to check the log record's msg and args for sensitive values
         # https://docs.python.org/3/library/logging.html#logrecord-attributes
-        msg_clone = None
-        args_clone = None
         if isinstance(record.msg, message.Message):
-            msg_clone = copy.deepcopy(record.msg)
-            msg_clone.accessToken = '<redacted>'
+            record.msg = _redacted(record.msg)
         if isinstance(record.args, dict):
-            for k in record.args.keys():
-                if isinstance(record.args[k], message.Message):
-                    if not args_clone:
-                        args_clone = copy.deepcopy(record.args)
-                    args_clone[k].accessToken = '<redacted>'
-        else:  # args is a tuple
-            for index, arg in enumerate(record.args):
-                if isinstance(arg, message.Message):
-                    if not args_clone:
-                        args_clone = copy.deepcopy(record.args)
-                    args_clone[index].accessToken = '<redacted>'
-        if msg_clone:
-            record.msg = msg_clone
-        if args_clone:
-            record.args = args_clone
+            if any(isinstance(arg, message.Message) for arg in record.args.values()):
+                record.args = {k: _redacted(arg) if isinstance(arg, message.Message) else arg
+                               for k, arg in record.args.items()}
+        elif any(isinstance(arg, message.Message) for arg in record.args):
+            record.args = tuple(_redacted(arg) if isinstance(arg, message.Message) else arg
+                                for arg in record.args)
         formatted_message = self.original_formatter.format(record)
         return formatted_message
 
@@ -116,5 +113,6 @@ def setup_stdout_log_formatting(config):
             if self.linebuf != '':
                 self.logger.log(self.log_level, self.linebuf.rstrip())
             self.linebuf = ''
-    sys.stdout = StreamToLogger(build_logger(config), logging.INFO)
-    sys.stderr = StreamToLogger(build_logger(config), logging.ERROR)
+    logger = build_logger(config)
+    sys.stdout = StreamToLogger(logger, logging.INFO)
+    sys.stderr = StreamToLogger(logger, logging.ERROR)
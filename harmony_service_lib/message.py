@@ -28,7 +28,7 @@ class JsonObject(object):
     """
     reprdepth = 0
 
-    def __init__(self, data, properties=[], list_properties={}):
+    def __init__(self, data, properties=None, list_properties=None):
         """
         Constructor
 
@@ -37,22 +37,22 @@ class JsonObject(object):
         data : dictionary
             The JSON dictionary created by json.loads at the root of this object
         properties : list, optional
-            A list of properties that should be extracted to attributes, by default []
+            A list of properties that should be extracted to attributes, by default none
         list_properties : dict, optional
             A dictionary of property name to type for properties that are lists of
-            JSONObject classes, by default {}
+            JSONObject classes, by default none
         """
+        properties = properties or []
+        list_properties = list_properties or {}
         self.output_data = data or {}
         self.data = copy.deepcopy(data) or {}
         self.properties = properties + list(list_properties.keys())
         self.processed = []
-        for prop in properties:
-            setattr(self, prop, data.get(prop))
-        for prop in list_properties:
-            Class = list_properties[prop]
-            items = data.get(prop) or []
-            value = [Class(item) for item in items]
-            setattr(self, prop, value)
+        # No subclass defines a descriptor under a property name, so the
+        # attributes can be assigned in bulk rather than through setattr
+        self.__dict__.update({prop: data.get(prop) for prop in properties})
+        self.__dict__.update({prop: [Class(item) for item in data.get(prop) or []]
+                              for prop, Class in list_properties.items()})
 
     def __getitem__(self, key):
         """
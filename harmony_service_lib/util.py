@@ -36,13 +36,14 @@ Optional:
 
 from base64 import b64decode
 from collections import namedtuple
+from concurrent.futures import Future
 from functools import lru_cache
 import hashlib
 import logging
-from pathlib import Path, PurePath
-from os import environ, path
+from os import environ, getpid, path, remove, replace, stat
 import sys
 import re
+import threading
 from urllib import parse
 
 from nacl.secret import SecretBox
@@ -60,6 +61,11 @@ from harmony_service_lib.version import get_version
 
 DEFAULT_SHARED_SECRET_KEY = '_THIS_IS_MY_32_CHARS_SECRET_KEY_'
 
+# Downloads in progress, keyed by destination path, so that concurrent requests
+# for the same file wait on a single fetch
+_downloads_in_flight = {}
+_downloads_in_flight_lock = threading.Lock()
+
 
 Config = namedtuple(
     'Config', [
@@ -209,24 +215,33 @@ def _url_as_filename(url: str) -> str:
     return url.replace('file://', '')
 
 
-def _filename(directory_path: str, url: str) -> Path:
+@lru_cache(maxsize=1024)
+def _filename(directory_path: str, url: str) -> str:
     """Constructs a filename from the url using the specified directory
-    as its path. The constructed filename will be a sha256 hash
+    as its path. The constructed filename will be a 128-bit blake2b hash
     (converted to a hex digest) of the url, and the file's extension
-    will be the same as that of the filename in the url.
+    will be the same as that of the filename in the url. Results are
+    cached, since the same url is often downloaded more than once.
 
     Parameters
     ----------
     directory_path : str
+        The directory in which the file will be placed.
+    url : str
         The url to use when constructing the filename and extension.
     Returns
     -------
-
+    str: The path of the file in directory_path.
     """
-    return Path(
-        directory_path,
-        hashlib.sha256(url.encode('utf-8')).hexdigest()
-    ).with_suffix(PurePath(parse.urlparse(url).path).suffix)
+    # The hash only needs to tell urls apart, not to be cryptographically
+    # strong, so use a fast hash with a shorter digest
+    digest = hashlib.blake2b(url.encode('utf-8'), digest_size=16, usedforsecurity=False).hexdigest()
+    # The extension of the last path segment, following the same rules as
+    # pathlib's PurePath.suffix without constructing path objects
+    name = parse.urlparse(url).path.rstrip('/').rpartition('/')[2]
+    dot = name.rfind('.')
+    suffix = name[dot:] if 0 < dot < len(name) - 1 else ''
+    return path.join(directory_path, digest + suffix)
 
 
 def download(url, destination_dir, logger=None, access_token=None, data=None, cfg=None):
@@ -274,23 +289,59 @@ def download(url, destination_dir, logger=None, access_token=None, data=None, cf
     source = http.localhost_url(url, cfg.localstack_host)
 
     destination_path = _filename(destination_dir, url)
-    if destination_path.exists():
-        return str(destination_path)
-    destination_path = str(destination_path)
+    try:
+        # Downloads are renamed into place only once complete, but versions that
+        # wrote straight to the destination could leave an empty file behind after an
+        # interruption; fetch those again (as well as any resource that is empty)
+        if stat(destination_path).st_size > 0:
+            return destination_path
+    except FileNotFoundError:
+        pass
+
+    with _downloads_in_flight_lock:
+        in_flight = _downloads_in_flight.get(destination_path)
+        if in_flight is None:
+            future = _downloads_in_flight[destination_path] = Future()
+    if in_flight is not None:
+        return in_flight.result()
+
+    try:
+        _download_to_file(source, url, destination_path, logger, access_token, data, cfg)
+        future.set_result(destination_path)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _downloads_in_flight_lock:
+            del _downloads_in_flight[destination_path]
 
-    full_user_agt = _build_full_user_agent(cfg)
+    return destination_path
 
-    with open(destination_path, 'wb') as destination_file:
-        if aws.is_s3(source):
-            aws.download(cfg, source, destination_file, full_user_agt)
-        elif http.is_http(source):
-            http.download(cfg, source, access_token, data, destination_file, full_user_agt)
-        else:
-            msg = f'Unable to download a url of unknown type: {url}'
-            logger.error(msg)
-            raise Exception(msg)
 
-    return destination_path
+def _download_to_file(source, url, destination_path, logger, access_token, data, cfg):
+    """Fetches source into destination_path for `download`."""
+    full_user_agt = _build_full_user_agent(cfg)
+
+    # Write to a private file and rename it into place once complete, so an
+    # interrupted download never leaves a partial file at destination_path
+    partial_path = f'{destination_path}.part.{getpid()}.{threading.get_ident()}'
+    try:
+        with open(partial_path, 'wb') as destination_file:
+            if aws.is_s3(source):
+                aws.download(cfg, source, destination_file, full_user_agt)
+            elif http.is_http(source):
+                http.download(cfg, source, access_token, data, destination_file, full_user_agt)
+            else:
+                msg = f'Unable to download a url of unknown type: {url}'
+                logger.error(msg)
+                raise Exception(msg)
+        replace(partial_path, destination_path)
+    except BaseException:
+        try:
+            remove(partial_path)
+        except FileNotFoundError:
+            pass
+        raise
 
 
 def stage(local_filename, remote_filename, mime, logger=None, location=None, cfg=None):
@@ -1,9 +1,20 @@
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import io
+import socket
+from time import sleep
+
 import pytest
+import requests
 import responses
 import os
+from io import BytesIO
 
-from harmony_service_lib.http import (download, is_http, localhost_url)
+from harmony_service_lib.http import (download, download_all, is_http, localhost_url, ERROR_BODY_LIMIT, POOL_SIZE,
+                                      _download, _earthdata_session,
+                                      _earthdata_auth, _eula_error_message, _log_download_performance)
 from unittest.mock import Mock, patch
+from harmony_service_lib.exceptions import ForbiddenException
 from tests.util import config_fixture
 
 EDL_URL = 'https://uat.urs.earthdata.nasa.gov'
@@ -17,7 +28,12 @@ EDL_URL = 'https://uat.urs.earthdata.nasa.gov'
     ('httpsnope://topsecret.org', False),
     ('s3://bucketbrigade.com', False),
     ('file:///var/log/junk.txt', False),
-    ('gopher://minnesota.org', False)
+    ('gopher://minnesota.org', False),
+    ('http:example.com', False),
+    (' https://nasa.gov/x', True),
+    ('\thttp://nasa.gov/x', True),
+    ('', False),
+    (None, False)
 ])
 def test_is_http(url, expected):
     assert is_http(url) is expected
@@ -34,6 +50,81 @@ def test_when_given_urls_localhost_url_returns_correct_url(url, expected):
     assert localhost_url(url, local_hostname) == expected
 
 
+@pytest.mark.parametrize('body,expected', [
+    (b'{"error_description":"EULA Acceptance Failure","resolution_url":"https://example.com/eula"}',
+     'Request could not be completed because you need to agree to the EULA at https://example.com/eula'),
+    (b'{"error_description":"Some other failure"}', None),
+    (b'["error_description", "resolution_url"]', None),
+    (b'<html>Forbidden</html>', None),
+    (b'<html>error_description resolution_url</html>', None),
+    (b'{"error_description": "\xff", "resolution_url": ""}', None),
+    (b'', None)
+])
+def test_eula_error_message(body, expected):
+    assert _eula_error_message(body) == expected
+
+
+def test_eula_error_message_does_not_parse_bodies_without_eula_keys(mocker):
+    json = mocker.patch('harmony_service_lib.http.json')
+
+    assert _eula_error_message(b'{"error_description":"Some other failure"}') is None
+    json.loads.assert_not_called()
+
+
+@pytest.mark.parametrize('url,host,path', [
+    ('https://example.com/data/granule.nc', 'example.com', '/data/granule.nc'),
+    ('https://example.com:8443/granule.nc?A-api-request-uuid=abc', 'example.com:8443', '/granule.nc?A-api-request-uuid=abc'),
+    ('https://example.com', 'example.com', ''),
+    ('not a url', 'Unknown', '')
+])
+def test_log_download_performance_logs_host_and_path(url, host, path):
+    logger = Mock()
+
+    _log_download_performance(logger, url, 10, 20)
+
+    logger.info.assert_called_with(
+        'timing.download.end',
+        extra={'durationMs': 10, 'host': host, 'path': path, 'size': 20}
+    )
+
+
+def test_earthdata_session_is_reused_and_pooled():
+    session = _earthdata_session()
+
+    assert _earthdata_session() is session
+    for prefix in ('https://', 'http://'):
+        adapter = session.get_adapter(f'{prefix}example.com')
+        assert adapter._pool_connections == POOL_SIZE
+        assert adapter._pool_maxsize == POOL_SIZE
+
+
+@responses.activate
+def test_download_reuses_the_earthdata_auth_for_a_token(
+        mocker,
+        access_token,
+        resource_server_granule_url):
+    responses.add(responses.GET, resource_server_granule_url, status=200)
+    cfg = config_fixture()
+
+    download(cfg, resource_server_granule_url, access_token, None, mocker.Mock())
+    auth = _earthdata_session().auth
+    download(cfg, resource_server_granule_url, access_token, None, mocker.Mock())
+
+    assert _earthdata_session().auth is auth
+    assert auth is _earthdata_auth(access_token)
+    assert auth.authorization_header == f'Bearer {access_token}'
+
+
+def test_earthdata_session_is_per_thread_and_shares_the_pool():
+    session = _earthdata_session()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        other_session = executor.submit(_earthdata_session).result()
+
+    assert other_session is not session
+    assert other_session.get_adapter('https://example.com') is session.get_adapter('https://example.com')
+
+
 @pytest.fixture
 def access_token(faker):
     return faker.password(length=40, special_chars=False)
@@ -68,10 +159,6 @@ def edl_redirect_url(faker):
             f'&state={faker.password(length=128, special_chars=False)}')
 
 
-@pytest.fixture(autouse=True)
-def getsize_patched(monkeypatch):
-    monkeypatch.setattr(os.path, "getsize", lambda a: 0)
-
 @responses.activate
 def test_download_follows_redirect_and_uses_auth_headers(
         mocker,
@@ -180,6 +267,209 @@ def test_when_authn_succeeds_it_writes_to_provided_file(
     destination_file.write.assert_called()
 
 
+@responses.activate
+def test_when_the_response_is_gzip_encoded_it_writes_the_decoded_body(
+        tmp_path,
+        access_token,
+        resource_server_granule_url,
+        response_body_from_granule_url):
+
+    responses.add(
+        responses.GET,
+        resource_server_granule_url,
+        body=gzip.compress(response_body_from_granule_url.encode('utf-8')),
+        headers={'Content-Encoding': 'gzip'},
+        status=200
+    )
+    destination_path = tmp_path / 'granule.nc'
+    cfg = config_fixture()
+
+    with open(destination_path, 'wb') as destination_file:
+        download(cfg, resource_server_granule_url, access_token, None, destination_file)
+
+    assert destination_path.read_text() == response_body_from_granule_url
+
+
+@responses.activate
+@pytest.mark.parametrize('buffer_size', [10, 16, 1024])
+def test_when_the_response_is_gzip_encoded_it_writes_the_whole_body_with_small_buffers(
+        tmp_path,
+        access_token,
+        resource_server_granule_url,
+        buffer_size):
+
+    body = b'x' * 12000
+    responses.add(
+        responses.GET,
+        resource_server_granule_url,
+        body=gzip.compress(body),
+        headers={'Content-Encoding': 'gzip'},
+        status=200
+    )
+    destination_path = tmp_path / 'granule.nc'
+    cfg = config_fixture()
+
+    with open(destination_path, 'wb') as destination_file:
+        download(cfg, resource_server_granule_url, access_token, None, destination_file,
+                 buffer_size=buffer_size)
+
+    assert destination_path.read_bytes() == body
+
+
+class _TimingOutStream(io.RawIOBase):
+    """A response body that times out once its first bytes have been read."""
+    def __init__(self, data):
+        self.data = data
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.data:
+            raise socket.timeout('timed out')
+        size = min(len(buffer), len(self.data))
+        buffer[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+
+@responses.activate
+def test_when_the_body_times_out_midstream_it_raises_a_requests_exception(
+        tmp_path,
+        access_token,
+        resource_server_granule_url):
+
+    responses.add(
+        responses.GET,
+        resource_server_granule_url,
+        body=io.BufferedReader(_TimingOutStream(b'x' * 1000)),
+        status=200
+    )
+    destination_path = tmp_path / 'granule.nc'
+    cfg = config_fixture()
+
+    with open(destination_path, 'wb') as destination_file:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            download(cfg, resource_server_granule_url, access_token, None, destination_file,
+                     buffer_size=100)
+
+
+@responses.activate
+def test_when_the_body_times_out_midstream_the_file_holds_only_the_bytes_received(
+        tmp_path,
+        access_token,
+        resource_server_granule_url):
+
+    responses.add(
+        responses.GET,
+        resource_server_granule_url,
+        body=io.BufferedReader(_TimingOutStream(b'x' * 1000)),
+        headers={'Content-Length': '100000'},
+        auto_calculate_content_length=False,
+        status=200
+    )
+    destination_path = tmp_path / 'granule.nc'
+    cfg = config_fixture()
+
+    with open(destination_path, 'wb') as destination_file:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            download(cfg, resource_server_granule_url, access_token, None, destination_file,
+                     buffer_size=100)
+
+    assert destination_path.stat().st_size == 1000
+
+
+@responses.activate
+def test_when_streaming_it_logs_the_number_of_bytes_written(
+        mocker,
+        access_token,
+        resource_server_granule_url,
+        response_body_from_granule_url):
+
+    responses.add(
+        responses.GET,
+        resource_server_granule_url,
+        body=response_body_from_granule_url,
+        status=200
+    )
+    log_download_performance = mocker.patch('harmony_service_lib.http._log_download_performance')
+    destination_file = BytesIO()
+    cfg = config_fixture()
+
+    download(cfg, resource_server_granule_url, access_token, None, destination_file)
+
+    assert destination_file.getvalue() == response_body_from_granule_url.encode('utf-8')
+    file_size = log_download_performance.call_args.args[3]
+    assert file_size == len(response_body_from_granule_url)
+
+
+@responses.activate
+def test_when_a_streamed_download_fails_it_reads_only_the_start_of_the_body(
+        access_token,
+        resource_server_granule_url):
+    responses.add(responses.GET, resource_server_granule_url, body=b'x' * (10 * ERROR_BODY_LIMIT), status=403)
+    cfg = config_fixture()
+
+    response = _download(cfg, resource_server_granule_url, access_token, None, 1, Mock(), stream=True)
+
+    assert response.status_code == 403
+    assert response.content == b'x' * ERROR_BODY_LIMIT
+
+
+@responses.activate
+def test_when_a_download_that_is_not_streamed_fails_it_keeps_the_whole_body(
+        access_token,
+        resource_server_granule_url):
+    responses.add(responses.GET, resource_server_granule_url, body=b'x' * (10 * ERROR_BODY_LIMIT), status=403)
+    cfg = config_fixture()
+
+    response = _download(cfg, resource_server_granule_url, access_token, None, 1, Mock(), stream=False)
+
+    assert response.status_code == 403
+    assert response.content == b'x' * (10 * ERROR_BODY_LIMIT)
+
+
+@responses.activate
+def test_when_not_streaming_it_logs_the_number_of_bytes_downloaded(
+        mocker,
+        access_token,
+        resource_server_granule_url,
+        response_body_from_granule_url):
+
+    responses.add(
+        responses.GET,
+        resource_server_granule_url,
+        body=response_body_from_granule_url,
+        status=200
+    )
+    log_download_performance = mocker.patch('harmony_service_lib.http._log_download_performance')
+    destination_file = BytesIO()
+    cfg = config_fixture()
+
+    download(cfg, resource_server_granule_url, access_token, None, destination_file, stream=False, buffer_size=None)
+
+    assert destination_file.getvalue() == response_body_from_granule_url.encode('utf-8')
+    file_size = log_download_performance.call_args.args[3]
+    assert file_size == len(response_body_from_granule_url)
+
+
+@responses.activate
+@patch('harmony_service_lib.http.monotonic_ns', Mock(side_effect=[5_000_000, 1_255_600_000]))
+def test_it_logs_the_download_duration_in_milliseconds(
+        mocker,
+        access_token,
+        resource_server_granule_url):
+
+    responses.add(responses.GET, resource_server_granule_url, status=200)
+    log_download_performance = mocker.patch('harmony_service_lib.http._log_download_performance')
+    cfg = config_fixture()
+
+    download(cfg, resource_server_granule_url, access_token, None, mocker.Mock())
+
+    duration_ms = log_download_performance.call_args.args[2]
+    assert duration_ms == 1251
+
+
 @responses.activate
 @patch('harmony_service_lib.http.get_retry_delay', Mock(return_value = 0))
 def test_download_all_retries_failed(
@@ -267,3 +557,63 @@ def test_retries_on_temporary_errors_edl_auth(
     assert rsp1.call_count == 1
     assert rsp2.call_count == 1
     assert rsp3.call_count == 1
+
+
+@responses.activate
+def test_download_all_downloads_each_url_and_returns_responses_in_order(
+        mocker,
+        access_token):
+    urls = [f'https://resource.server.daac.com/foo/bar/granule_{i}.nc' for i in range(4)]
+    for i, url in enumerate(urls):
+        responses.add(responses.GET, url, body=f'granule {i}', status=200)
+    destination_files = [mocker.Mock() for _ in urls]
+    cfg = config_fixture()
+
+    result = download_all(cfg, [(url, access_token, None, destination_file)
+                                for url, destination_file in zip(urls, destination_files)])
+
+    assert [r.url for r in result] == urls
+    assert len(responses.calls) == len(urls)
+    for destination_file in destination_files:
+        destination_file.write.assert_called()
+
+
+@responses.activate
+def test_download_all_sends_each_items_own_access_token(mocker):
+    urls = [f'https://resource.server.daac.com/foo/bar/granule_{i}.nc' for i in range(8)]
+    tokens = [f'tok{i}' for i in range(8)]
+    sent_tokens = {}
+
+    def redirect(request):
+        # Delay so that every worker has set up its request before any is redirected
+        sleep(0.05)
+        return (302, {'Location': request.url.replace('resource.server', 'redirected.server')}, '')
+
+    def record_token(request):
+        sent_tokens[request.url.replace('redirected.server', 'resource.server')] = request.headers['Authorization']
+        return (200, {}, 'granule')
+
+    for url in urls:
+        responses.add_callback(responses.GET, url, callback=redirect)
+        responses.add_callback(responses.GET, url.replace('resource.server', 'redirected.server'),
+                               callback=record_token)
+    cfg = config_fixture()
+
+    download_all(cfg, [(url, token, None, mocker.Mock()) for url, token in zip(urls, tokens)])
+
+    assert sent_tokens == {url: f'Bearer {token}' for url, token in zip(urls, tokens)}
+
+
+@responses.activate
+@patch('harmony_service_lib.http.get_retry_delay', Mock(return_value = 0))
+def test_download_all_raises_the_first_exception_in_item_order(
+        mocker,
+        access_token):
+    urls = [f'https://resource.server.daac.com/foo/bar/granule_{i}.nc' for i in range(3)]
+    responses.add(responses.GET, urls[0], status=200)
+    responses.add(responses.GET, urls[1], status=401)
+    responses.add(responses.GET, urls[2], status=500)
+    cfg = config_fixture()
+
+    with pytest.raises(ForbiddenException):
+        download_all(cfg, [(url, access_token, None, mocker.Mock()) for url in urls])
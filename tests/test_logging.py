@@ -1,8 +1,11 @@
 import unittest
 import copy
+import json
+import logging
 from io import StringIO
+from unittest.mock import patch
 
-from harmony_service_lib.logging import build_logger
+from harmony_service_lib.logging import build_logger, HarmonyJsonFormatter
 from tests.util import config_fixture
 from harmony_service_lib.message import Message
 from .example_messages import minimal_message
@@ -83,4 +86,29 @@ class TestLoggingRedaction(unittest.TestCase):
         # check that the message wasn't mutated
         assert(self.harmony_message.accessToken == self.token)
         
-        
\ No newline at end of file
+        
+    def test_message_is_not_deep_copied_to_redact_it(self):
+        self.configure_logger(text_logger=True)
+        with patch('copy.deepcopy', side_effect=AssertionError('deepcopy called')):
+            self.logger.info(self.harmony_message)
+            self.logger.info('the Harmony message is %s', self.harmony_message)
+            self.logger.info('the Harmony message is %s', {'the_harmony_message': self.harmony_message})
+        log = self.buffer.getvalue()
+        assert(log.count("accessToken = '<redacted>'") == 3)
+        assert(self.token not in log)
+        assert(self.harmony_message.accessToken == self.token)
+
+
+class TestHarmonyJsonFormatter(unittest.TestCase):
+
+    def test_timestamp_is_the_utc_time_the_record_was_created(self):
+        formatter = HarmonyJsonFormatter()
+        formatter.app_name = 'test'
+        record = logging.LogRecord('harmony-service', logging.INFO, __file__, 1, 'hello', None, None)
+        record.created = 1700000000.000123
+
+        log = json.loads(formatter.format(record))
+
+        self.assertEqual(log['timestamp'], '2023-11-14T22:13:20.000123Z')
+        self.assertEqual(log['level'], 'INFO')
+        self.assertEqual(log['application'], 'test')
@@ -12,6 +12,10 @@ from tests.util import config_fixture
 class TestDownload(unittest.TestCase):
     def setUp(self):
         self.config = util.config(validate=False)
+        # open() is mocked in these tests, so there is no partial file to rename
+        replace_patcher = patch('harmony_service_lib.util.replace')
+        replace_patcher.start()
+        self.addCleanup(replace_patcher.stop)
 
     @patch('harmony_service_lib.util.get_version')
     @patch('boto3.client')
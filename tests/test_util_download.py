@@ -1,3 +1,6 @@
+import os
+import threading
+from pathlib import PurePath
 from unittest import mock
 from unittest.mock import Mock, patch
 
@@ -20,10 +23,34 @@ def test_url_as_filename(url, expected):
     assert fn == expected
 
 
+def test_filename_hashes_the_url_and_keeps_its_extension():
+    url = 'https://example.com/data/granule.nc4?dap4.ce=latitude'
+
+    fn = util._filename('/tmp/downloads', url)
+
+    directory, name = os.path.split(fn)
+    assert directory == '/tmp/downloads'
+    assert name.endswith('.nc4')
+    assert len(name) == 32 + len('.nc4')
+    assert fn != util._filename('/tmp/downloads', 'https://example.com/data/other.nc4')
+    assert util._filename('/tmp/downloads', url) is fn
+
+
+@pytest.mark.parametrize('url_path', [
+    '/data/granule.nc4', '/data/granule.tar.gz', '/data/granule', '/data/.hidden',
+    '/data/granule.', '/data/granule.nc4/', '/data.d/granule', ''
+])
+def test_filename_keeps_the_same_extension_as_pathlib(url_path):
+    fn = util._filename('/tmp/downloads', f'https://example.com{url_path}?a=b.c')
+
+    assert os.path.splitext(fn)[1] == PurePath(url_path).suffix
+
+
 def test_when_given_an_s3_uri_it_downloads_the_s3_file(monkeypatch, mocker, faker):
     access_token = faker.password(length=40, special_chars=False)
     aws_download = mocker.Mock()
     monkeypatch.setattr(util.aws, 'download', aws_download)
+    mocker.patch.object(util, 'replace')
     config = config_fixture()
 
     with mock.patch('builtins.open', mock.mock_open()):
@@ -36,6 +63,7 @@ def test_when_given_an_http_url_it_downloads_the_url(monkeypatch, mocker, faker)
     access_token = faker.password(length=40, special_chars=False)
     http_download = mocker.Mock()
     monkeypatch.setattr(util.http, 'download', http_download)
+    mocker.patch.object(util, 'replace')
     config = config_fixture()
 
     with mock.patch('builtins.open', mock.mock_open()):
@@ -44,6 +72,84 @@ def test_when_given_an_http_url_it_downloads_the_url(monkeypatch, mocker, faker)
     http_download.assert_called()
 
 
+def test_when_the_file_was_already_downloaded_it_is_not_fetched_again(monkeypatch, mocker, tmp_path):
+    http_download = mocker.Mock()
+    monkeypatch.setattr(util.http, 'download', http_download)
+    url = 'https://example.com/file.txt'
+    destination = util._filename(str(tmp_path), url)
+    with open(destination, 'wb') as f:
+        f.write(b'data')
+
+    assert util.download(url, str(tmp_path), cfg=config_fixture()) == destination
+
+    http_download.assert_not_called()
+
+
+def test_when_an_empty_file_was_left_behind_it_is_fetched_again(monkeypatch, mocker, tmp_path):
+    http_download = mocker.Mock()
+    monkeypatch.setattr(util.http, 'download', http_download)
+    url = 'https://example.com/file.txt'
+    destination = util._filename(str(tmp_path), url)
+    open(destination, 'wb').close()
+
+    assert util.download(url, str(tmp_path), cfg=config_fixture()) == destination
+
+    http_download.assert_called_once()
+
+
+def test_the_download_is_moved_into_place_only_once_complete(monkeypatch, tmp_path):
+    url = 'https://example.com/file.txt'
+    destination = util._filename(str(tmp_path), url)
+
+    def http_download(cfg, url, access_token, data, destination_file, user_agent):
+        destination_file.write(b'data')
+        assert not os.path.exists(destination)
+    monkeypatch.setattr(util.http, 'download', http_download)
+
+    assert util.download(url, str(tmp_path), cfg=config_fixture()) == destination
+
+    with open(destination, 'rb') as f:
+        assert f.read() == b'data'
+    assert os.listdir(tmp_path) == [os.path.basename(destination)]
+
+
+def test_when_the_download_fails_no_partial_file_is_left_behind(monkeypatch, tmp_path):
+    def http_download(cfg, url, access_token, data, destination_file, user_agent):
+        destination_file.write(b'da')
+        raise ServerException('connection reset')
+    monkeypatch.setattr(util.http, 'download', http_download)
+
+    with pytest.raises(ServerException):
+        util.download('https://example.com/file.txt', str(tmp_path), cfg=config_fixture())
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_concurrent_downloads_of_the_same_url_are_fetched_once(monkeypatch, tmp_path):
+    url = 'https://example.com/file.txt'
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def http_download(cfg, url, access_token, data, destination_file, user_agent):
+        calls.append(url)
+        started.set()
+        release.wait(5)
+        destination_file.write(b'data')
+    monkeypatch.setattr(util.http, 'download', http_download)
+    config = config_fixture()
+
+    first = threading.Thread(target=util.download, args=(url, str(tmp_path)), kwargs={'cfg': config})
+    first.start()
+    started.wait(5)
+    threading.Timer(0.2, release.set).start()
+    destination = util.download(url, str(tmp_path), cfg=config)
+    first.join()
+
+    assert destination == util._filename(str(tmp_path), url)
+    assert len(calls) == 1
+
+
 @patch('harmony_service_lib.http.get_retry_delay', Mock(return_value = 0))
 def test_when_given_unknown_url_it_raises_exception(faker):
     access_token = faker.password(length=40, special_chars=False)
@@ -58,6 +164,7 @@ def test_when_given_a_file_url_it_returns_the_file_path(monkeypatch, mocker, fak
     access_token = faker.password(length=40, special_chars=False)
     http_download = mocker.Mock()
     monkeypatch.setattr(util.http, 'download', http_download)
+    mocker.patch.object(util, 'replace')
     config = config_fixture()
 
     with mock.patch('builtins.open', mock.mock_open()):
@@ -87,6 +194,7 @@ def test_when_given_file_url_with_parameters_returns_file_path(monkeypatch,
     access_token = faker.password(length=40, special_chars=False)
     http_download = mocker.Mock()
     monkeypatch.setattr(util.http, 'download', http_download)
+    mocker.patch.object(util, 'replace')
     config = config_fixture()
 
     with mock.patch('builtins.open', mock.mock_open()):